@@ -1,13 +1,15 @@
 from __future__ import annotations
 
+import io
 import json
+import time
 from datetime import datetime, date as date_cls
-from decimal import Decimal, InvalidOperation
 from typing import Any, Dict, Optional
 from urllib.parse import urlparse
 
 import requests
-import xml.etree.ElementTree as ET
+from lxml import etree
+from requests.adapters import HTTPAdapter
 
 import frappe
 from frappe import _
@@ -17,50 +19,82 @@ BNM_URL = "https://www.bnm.md/en/official_exchange_rates"
 BNM_TIMEOUT = 30
 
 CACHE_TTL_SECONDS = 24 * 60 * 60  # 24 hours
-CACHE_KEYS_LIST = "bnm:rates:keys:v1"
+CACHE_KEYS_LIST = "bnm:rates:keys:v3"
 CACHE_PREFIX = "bnm:rates:v1"  # final key: bnm:rates:v1:<DD.MM.YYYY>
+CACHE_MRU_LIMIT = 10
+
+# Process-local layer in front of the Redis cache: bnm_date -> (stored_at, rates).
+# Dict insertion order is used as MRU order (most recent last).
+_LOCAL_RATES: dict[str, tuple[float, dict[str, float]]] = {}
+
+# KEYS[1] = MRU zset; ARGV = score, member (full redis key), limit, ttl.
+# Members beyond the `limit` most recent are removed from the zset and deleted.
+_MRU_TOUCH_LUA = """
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+local stop = -(tonumber(ARGV[3]) + 1)
+local evicted = redis.call('ZRANGE', KEYS[1], 0, stop)
+if #evicted > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, stop)
+    redis.call('DEL', unpack(evicted))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return #evicted
+"""
+_MRU_SCRIPT = None
+
+# Shared HTTP session so cache misses reuse the keep-alive connection to BNM
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
 
 
 def _to_bnm_date_str(dt: date_cls) -> str:
     return dt.strftime("%d.%m.%Y")
 
 
-def _parse_decimal(value: str) -> Decimal:
-    v = (value or "").strip().replace(",", ".")
+def _parse_rate(value: Any) -> float:
+    v = (value if isinstance(value, str) else str(value)).strip()
     try:
-        return Decimal(v)
-    except (InvalidOperation, ValueError) as e:
+        # BNM uses "." as decimal separator; only normalize "," when needed
+        return float(v)
+    except ValueError:
+        pass
+    try:
+        return float(v.replace(",", "."))
+    except ValueError as e:
         raise frappe.ValidationError(_("Invalid numeric rate value: {0}").format(value)) from e
 
 
-def _fetch_bnm_rates(dt: date_cls) -> Dict[str, Decimal]:
+def _fetch_bnm_rates(dt: date_cls) -> Dict[str, float]:
     params = {"get_xml": "1", "date": _to_bnm_date_str(dt)}
-    resp = requests.get(BNM_URL, params=params, timeout=BNM_TIMEOUT)
+    resp = _SESSION.get(BNM_URL, params=params, timeout=BNM_TIMEOUT)
     resp.raise_for_status()
 
-    try:
-        root = ET.fromstring(resp.text)
-    except ET.ParseError as e:
-        raise frappe.ValidationError(_("BNM returned invalid XML.")) from e
-
-    rates: Dict[str, Decimal] = {}
+    rates: Dict[str, float] = {}
 
     # Expected structure: <Valute><CharCode>EUR</CharCode><Nominal>1</Nominal><Value>...</Value></Valute>
-    for valute in root.findall(".//Valute"):
-        code = (valute.findtext("CharCode") or "").strip().upper()
-        value_text = (valute.findtext("Value") or "").strip()
-        nominal_text = (valute.findtext("Nominal") or "1").strip()
+    # Stream over <Valute> elements instead of building the whole tree.
+    # The response comes from the network: never resolve entities or load external resources.
+    try:
+        for _event, valute in etree.iterparse(
+            io.BytesIO(resp.content), tag="Valute", resolve_entities=False, no_network=True
+        ):
+            code = (valute.findtext("CharCode") or "").strip().upper()
+            value_text = (valute.findtext("Value") or "").strip()
+            nominal_text = (valute.findtext("Nominal") or "1").strip()
+            valute.clear()
 
-        if not code or not value_text:
-            continue
+            if not code or not value_text:
+                continue
 
-        value = _parse_decimal(value_text)
-        nominal = _parse_decimal(nominal_text)
+            value = _parse_rate(value_text)
+            nominal = _parse_rate(nominal_text)
 
-        if nominal != 0:
-            value = value / nominal
+            if nominal != 0:
+                value = value / nominal
 
-        rates[code] = value
+            rates[code] = value
+    except etree.XMLSyntaxError as e:
+        raise frappe.ValidationError(_("BNM returned invalid XML.")) from e
 
     if not rates:
         raise frappe.ValidationError(_("No currency rates found in BNM XML response."))
@@ -84,53 +118,76 @@ def _cache_set(key: str, payload: Any) -> None:
     cache.set_value(key, json.dumps(payload, ensure_ascii=False), expires_in_sec=CACHE_TTL_SECONDS)
 
 
-def _keys_list_get() -> list:
-    data = _cache_get(CACHE_KEYS_LIST)
-    return data if isinstance(data, list) else []
+def _keys_list_push_and_trim(new_key: str, limit: int = 10) -> None:
+    # MRU set of cached dates kept as a Redis ZSET scored by last access time.
+    # Touch, trim and delete evicted entries atomically in one round-trip.
+    global _MRU_SCRIPT
 
+    cache = frappe.cache()
+    if _MRU_SCRIPT is None:
+        _MRU_SCRIPT = cache.register_script(_MRU_TOUCH_LUA)
 
-def _keys_list_push_and_trim(new_key: str, limit: int = 10) -> None:
-    keys = _keys_list_get()
+    _MRU_SCRIPT(
+        keys=[cache.make_key(CACHE_KEYS_LIST)],
+        args=[time.time(), cache.make_key(new_key), limit, CACHE_TTL_SECONDS],
+    )
 
-    keys = [k for k in keys if k != new_key]
-    keys.insert(0, new_key)
 
-    evicted = keys[limit:]
-    keys = keys[:limit]
+def _local_rates_get(bnm_date: str) -> dict[str, float] | None:
+    entry = _LOCAL_RATES.pop(bnm_date, None)
+    if entry is None:
+        return None
 
-    cache = frappe.cache()
-    for k in evicted:
-        cache.delete_value(k)
+    stored_at, rates = entry
+    if time.monotonic() - stored_at > CACHE_TTL_SECONDS:
+        return None
+
+    # Re-insert to mark as most recently used
+    _LOCAL_RATES[bnm_date] = entry
+    return rates
 
-    _cache_set(CACHE_KEYS_LIST, keys)
 
+def _local_rates_set(bnm_date: str, rates: dict[str, float], limit: int = CACHE_MRU_LIMIT) -> None:
+    _LOCAL_RATES.pop(bnm_date, None)
+    _LOCAL_RATES[bnm_date] = (time.monotonic(), rates)
 
-def get_bnm_rates_cached(dt: date_cls) -> Dict[str, Decimal]:
+    while len(_LOCAL_RATES) > limit:
+        _LOCAL_RATES.pop(next(iter(_LOCAL_RATES)))
+
+
+def get_bnm_rates_cached(dt: date_cls) -> Dict[str, float]:
     """
     Fetch BNM rates with MRU cache of last 10 dates.
-    Returns dict like {"EUR": Decimal("19.12"), ...} representing: 1 CUR = X MDL.
+    Returns dict like {"EUR": 19.12, ...} representing: 1 CUR = X MDL.
     """
     bnm_date = _to_bnm_date_str(dt)
+
+    local = _local_rates_get(bnm_date)
+    if local is not None:
+        return local
+
     cache_key = f"{CACHE_PREFIX}:{bnm_date}"
 
     cached = _cache_get(cache_key)
     if isinstance(cached, dict) and isinstance(cached.get("rates"), dict):
-        _keys_list_push_and_trim(cache_key, limit=10)
+        _keys_list_push_and_trim(cache_key, limit=CACHE_MRU_LIMIT)
         rates_raw = cached["rates"]
-        out: Dict[str, Decimal] = {}
+        out: Dict[str, float] = {}
         for k, v in rates_raw.items():
-            out[str(k).upper()] = _parse_decimal(str(v))
+            out[str(k).upper()] = _parse_rate(v)
+        _local_rates_set(bnm_date, out)
         return out
 
     rates = _fetch_bnm_rates(dt)
     payload = {
         "date": bnm_date,
-        "rates": {k: str(v) for k, v in rates.items()},
+        "rates": rates,
         "fetched_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
     }
 
     _cache_set(cache_key, payload)
-    _keys_list_push_and_trim(cache_key, limit=10)
+    _keys_list_push_and_trim(cache_key, limit=CACHE_MRU_LIMIT)
+    _local_rates_set(bnm_date, rates)
     return rates
 
 
@@ -146,7 +203,7 @@ def _require_bnm_key(provided_key: str) -> None:
         frappe.throw(_("Invalid key."), frappe.PermissionError)
 
 
-def _calc_rate_via_mdl(rates: Dict[str, Decimal], from_currency: str, to_currency: str) -> float:
+def _calc_rate_via_mdl(rates: Dict[str, float], from_currency: str, to_currency: str) -> float:
     fc = (from_currency or "").upper().strip()
     tc = (to_currency or "").upper().strip()
 
@@ -157,16 +214,16 @@ def _calc_rate_via_mdl(rates: Dict[str, Decimal], from_currency: str, to_currenc
     if fc == "MDL" and tc != "MDL":
         if tc not in rates:
             frappe.throw(_("BNM rate not found for {0}.").format(tc))
-        return float(Decimal("1") / rates[tc])
+        return 1.0 / rates[tc]
 
     if tc == "MDL" and fc != "MDL":
         if fc not in rates:
             frappe.throw(_("BNM rate not found for {0}.").format(fc))
-        return float(rates[fc])
+        return rates[fc]
 
     if fc not in rates or tc not in rates:
         frappe.throw(_("BNM rate not found for {0} or {1}.").format(fc, tc))
-    return float(rates[fc] / rates[tc])
+    return rates[fc] / rates[tc]
 
 
 @frappe.whitelist(allow_guest=True)
@@ -6,7 +6,8 @@ import csv
 import io
 import json
 import re
-from datetime import datetime
+import sys
+from datetime import date, datetime
 
 import frappe
 import openpyxl
@@ -19,7 +20,39 @@ from frappe.utils.xlsxutils import ILLEGAL_CHARACTERS_RE, handle_html
 from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
 
-INVALID_VALUES = ("", None)
+from erpnext_moldova_banking.utils.bank_transaction_automation import flush_bank_transactions
+
+INVALID_VALUES = frozenset(("", None))
+
+# A stripped DBO marker line, or a "KEY=value" line (split at the first "=").
+# Every marker has its own group, so match.lastindex tells which kind of line matched.
+DBO_LINE_RE = re.compile(
+	r"^[^\S\n]*(?:"
+	r"(?:(SECTIONACCOUNTSTART)|(SECTIONACCOUNTSTOP)|(DocStart)|(DocEnd))[^\S\n]*$"
+	r"|([^=\n]*)=(.*)$)",
+	re.MULTILINE,
+)
+DBO_SECTION_START, DBO_SECTION_STOP, DBO_DOC_START, DBO_DOC_END = 1, 2, 3, 4
+DBO_KEY_VALUE = 6
+
+# Description label templates of the counterparty block, per counterparty role
+DBO_COUNTERPARTY_LABELS = {
+	role: tuple(f"{role}{label}: %s" for label in ("", " IDNO", " Account", " Bank", " Bank BIC"))
+	for role in ("Payer", "Receiver")
+}
+
+# Tags that must all be present in a DBO file (with and without account info)
+DBO_FORMAT_TAGS_RE = re.compile(r"DocStart|DocEnd|BEGINDATE|ENDDATE")
+DBO_ACCOUNT_TAGS_RE = re.compile(r"SECTIONACCOUNTSTART|SECTIONACCOUNTSTOP")
+
+# A general IBAN pattern (adjust for more specific country rules if needed)
+IBAN_RE = re.compile(r"^[A-Z]{2}\d{2}[A-Z0-9]{11,30}$")
+IBAN_STRIP_TABLE = str.maketrans("", "", " \t")
+
+# str.translate table deleting every BMP character matched by ILLEGAL_CHARACTERS_RE
+ILLEGAL_CHARACTERS_TABLE = dict.fromkeys(
+	map(ord, ILLEGAL_CHARACTERS_RE.findall("".join(map(chr, range(0x10000))))), None
+)
 
 
 class MoldovaBankStatementImport(DataImport):
@@ -54,18 +87,16 @@ class MoldovaBankStatementImport(DataImport):
 
 	def validate(self):
 		doc_before_save = self.get_doc_before_save()
-		if (
-			not (self.import_file or self.google_sheets_url)
-			or (doc_before_save and doc_before_save.import_file != self.import_file)
-			or (doc_before_save and doc_before_save.google_sheets_url != self.google_sheets_url)
-		):
-			template_options_dict = {}
-			column_to_field_map = {}
+		# Only rebuild the mapping for a new document or when the import source changed,
+		# not on unrelated edits (e.g. toggling show_failed_logs). Bank is set only once.
+		source_changed = not doc_before_save or (
+			doc_before_save.import_file != self.import_file
+			or doc_before_save.google_sheets_url != self.google_sheets_url
+		)
+		if source_changed:
 			bank = frappe.get_doc("Bank", self.bank)
-			for i in bank.bank_transaction_mapping:
-				column_to_field_map[i.file_field] = i.bank_transaction_field
-			template_options_dict["column_to_field_map"] = column_to_field_map
-			self.template_options = json.dumps(template_options_dict)
+			column_to_field_map = {i.file_field: i.bank_transaction_field for i in bank.bank_transaction_mapping}
+			self.template_options = json.dumps({"column_to_field_map": column_to_field_map})
 
 			self.template_warnings = ""
 
@@ -74,11 +105,9 @@ class MoldovaBankStatementImport(DataImport):
 			self.validate_google_sheets_url()
 
 	def start_import(self):
-		preview = frappe.get_doc("Moldova Bank Statement Import", self.name).get_preview_from_template(
-			self.import_file, self.google_sheets_url
-		)
+		preview = self.get_preview_from_template(self.import_file, self.google_sheets_url)
 
-		if "Bank Account" not in json.dumps(preview["columns"]):
+		if not has_bank_account_column(preview["columns"]):
 			frappe.throw(_("Please add the Bank Account column"))
 
 		from frappe.utils.background_jobs import is_job_enqueued
@@ -109,11 +138,10 @@ class MoldovaBankStatementImport(DataImport):
 
 @frappe.whitelist()
 def convert_dbo_to_csv(data_import, dbo_file_path):
-	from frappe.utils import cstr
-
 	doc = frappe.get_doc("Moldova Bank Statement Import", data_import)
 
 	_file_doc, content = get_file(dbo_file_path)
+	content = decode_dbo_content(content)
 
 	is_dbo = is_dbo_format(content)
 	if not is_dbo:
@@ -131,12 +159,17 @@ def convert_dbo_to_csv(data_import, dbo_file_path):
 	except Exception as e:
 		frappe.throw(_("Failed to parse DBO format. Error: {0}").format(str(e)))
 
+	# The raw statement is no longer needed; release it before the CSV is built
+	del content
+
 	if not transactions:
 		frappe.throw(_("Parsed file is not in valid DBO format or contains no transactions."))
 
-	# Use in-memory file buffer instead of writing to temp file
-	csv_buffer = io.StringIO()
-	writer = csv.writer(csv_buffer)
+	# Use in-memory file buffer instead of writing to temp file.
+	# Rows are encoded straight into a bytes buffer, so no full-size str copy is kept.
+	csv_buffer = io.BytesIO()
+	csv_text = io.TextIOWrapper(csv_buffer, encoding="utf-8", newline="", write_through=True)
+	writer = csv.writer(csv_text)
 
 	headers = [
 		"Date",
@@ -155,46 +188,12 @@ def convert_dbo_to_csv(data_import, dbo_file_path):
 
 	writer.writerow(headers)
 
-	for txn in transactions:
-
-		# Date & currency safe formatting
-		dt = txn.get("date")
-		date_str = cstr(dt) if dt else ""
-
-		deposit = txn.get("deposit") or 0
-		withdrawal = txn.get("withdrawal") or 0
-		description = (txn.get("description") or "").replace("\r\n", "\n") or ""
-		reference = txn.get("reference_number") or ""
-		currency = txn.get("currency", "")
-		
-        # Party resolution based on IDNO
-		party_type, party = resolve_party_by_idno(txn)
-
-		# Counterparty account split into account number vs IBAN
-		cp_account_raw = (txn.get("cp_account") or "").strip()
-		is_iban = is_iban_valid(cp_account_raw.replace(" ", ""))
-
-		party_iban = cp_account_raw if is_iban else ""
-		party_account_no = "" if is_iban else cp_account_raw
-
-		writer.writerow([
-			date_str, 
-			deposit, 
-			withdrawal, 
-			description, 
-			reference, 
-			doc.bank_account, 
-			currency,
-            party_type or "",
-            party or "",
-            (txn.get("cp_name") or ""),
-            party_account_no,
-            party_iban,
-        ])
+	writer.writerows(iter_dbo_csv_rows(transactions, doc.bank_account))
 
 	# Prepare in-memory CSV for upload
-	csv_content = csv_buffer.getvalue().encode("utf-8")
-	csv_buffer.close()
+	csv_text.flush()
+	csv_content = csv_buffer.getvalue()
+	csv_text.close()
 
 	filename = f"{frappe.utils.now_datetime().strftime('%Y%m%d%H%M%S')}_converted_dbo.csv"
 
@@ -228,27 +227,47 @@ def download_import_log(data_import_name):
 	return frappe.get_doc("Moldova Bank Statement Import", data_import_name).download_import_log()
 
 
+def decode_dbo_content(content: str | bytes) -> str:
+	"""Return DBO file content as text.
+
+	``get_file`` hands back text when the file is valid UTF-8 and raw bytes
+	otherwise; the latter are legacy Windows-1251 exports.
+	"""
+	if isinstance(content, bytes):
+		content = content.decode("cp1251", errors="replace")
+
+	# A UTF-8 BOM would otherwise end up glued to the first key
+	return content.removeprefix("\ufeff")
+
+
+def _has_all_tags(content: str, tags_re: re.Pattern, tags_count: int) -> bool:
+	"""Scan content once, stopping as soon as every tag matched by tags_re has been seen"""
+	seen = set()
+	for match in tags_re.finditer(content):
+		seen.add(match.group())
+		if len(seen) == tags_count:
+			return True
+	return False
+
 def is_dbo_format(content: str) -> bool:
 	"""Check if the content has key DBO tags"""
-	required_tags = ["DocStart", "DocEnd", "BEGINDATE", "ENDDATE"]
-	return all(tag in content for tag in required_tags)
+	return _has_all_tags(content, DBO_FORMAT_TAGS_RE, 4)
 
 def has_account_info(content: str) -> bool:
 	"""Check if the content has key DBO tags"""
-	required_tags = ["SECTIONACCOUNTSTART","SECTIONACCOUNTSTOP"]
-	return all(tag in content for tag in required_tags)
-
-def parse_data_from_template(raw_data):
-	data = []
-
-	for _i, row in enumerate(raw_data):
-		if all(v in INVALID_VALUES for v in row):
-			# empty row
-			continue
+	return _has_all_tags(content, DBO_ACCOUNT_TAGS_RE, 2)
 
-		data.append(row)
+def has_bank_account_column(columns) -> bool:
+	"""Check if the import preview has a Bank Account column (by header or mapped field)"""
+	for col in columns:
+		df = col.get("df") or {}
+		if "Bank Account" in (col.get("header_title") or "") or df.get("label") == "Bank Account":
+			return True
+	return False
 
-	return data
+def parse_data_from_template(raw_data):
+	# Skip empty rows; any() stops at the first filled cell
+	return [row for row in raw_data if any(v not in INVALID_VALUES for v in row)]
 
 
 def start_import(data_import, bank_account, import_file_path, google_sheets_url, bank, template_options):
@@ -270,29 +289,76 @@ def start_import(data_import, bank_account, import_file_path, google_sheets_url,
 		add_bank_account(data, bank_account)
 		write_files(import_file, data)
 
+	# Bank Transaction automation is collected during the import (committed rows only)
+	# and run as one batch job
+	frappe.local.pending_bank_transactions = []
+
 	try:
 		i = Importer(data_import.reference_doctype, data_import=data_import)
 		i.import_data()
 	except Exception:
 		frappe.db.rollback()
+		# No automation batch for a failed import
+		frappe.local.pending_bank_transactions = None
 		data_import.db_set("status", "Error")
 		data_import.log_error("Moldova Bank Statement Import failed")
 	finally:
 		frappe.flags.in_import = False
+		flush_bank_transactions()
 
 	frappe.publish_realtime("data_import_refresh", {"data_import": data_import.name})
 
 
 def update_mapping_db(bank, template_options):
 	"""Update bank transaction mapping database with template options."""
-	bank = frappe.get_doc("Bank", bank)
-	for d in bank.bank_transaction_mapping:
-		d.delete()
+	column_to_field_map = json.loads(template_options)["column_to_field_map"]
+
+	# Replace the child rows directly: one DELETE and one multi-row INSERT instead of
+	# a per-row delete followed by a full Bank save
+	frappe.db.delete(
+		"Bank Transaction Mapping",
+		{"parent": bank, "parenttype": "Bank", "parentfield": "bank_transaction_mapping"},
+	)
+
+	now = frappe.utils.now()
+	user = frappe.session.user
+	values = [
+		(
+			frappe.generate_hash(length=10),
+			bank,
+			"Bank",
+			"bank_transaction_mapping",
+			idx,
+			file_field,
+			bank_transaction_field,
+			now,
+			now,
+			user,
+			user,
+		)
+		for idx, (file_field, bank_transaction_field) in enumerate(column_to_field_map.items(), start=1)
+	]
 
-	for d in json.loads(template_options)["column_to_field_map"].items():
-		bank.append("bank_transaction_mapping", {"bank_transaction_field": d[1], "file_field": d[0]})
+	if values:
+		frappe.db.bulk_insert(
+			"Bank Transaction Mapping",
+			fields=[
+				"name",
+				"parent",
+				"parenttype",
+				"parentfield",
+				"idx",
+				"file_field",
+				"bank_transaction_field",
+				"creation",
+				"modified",
+				"owner",
+				"modified_by",
+			],
+			values=values,
+		)
 
-	bank.save()
+	frappe.clear_document_cache("Bank", bank)
 
 
 def add_bank_account(data, bank_account):
@@ -351,9 +417,9 @@ def write_xlsx(data, sheet_name, wb=None, column_widths=None, file_path=None):
 			else:
 				value = item
 
-			if isinstance(item, str) and next(ILLEGAL_CHARACTERS_RE.finditer(value), None):
+			if isinstance(item, str):
 				# Remove illegal characters from the string
-				value = re.sub(ILLEGAL_CHARACTERS_RE, "", value)
+				value = value.translate(ILLEGAL_CHARACTERS_TABLE)
 
 			clean_row.append(value)
 
@@ -427,6 +493,21 @@ def parse_date(value: str):
     if not value:
         return None
 
+    # Fast path for the usual zero-padded DD.MM.YYYY; int() would also accept
+    # " 1", "+1" or "2_5", so every part must be plain ASCII digits
+    if (
+        len(value) == 10
+        and value[2] == value[5] == "."
+        and value.isascii()
+        and value[:2].isdigit()
+        and value[3:5].isdigit()
+        and value[6:].isdigit()
+    ):
+        try:
+            return date(int(value[6:]), int(value[3:5]), int(value[:2]))
+        except ValueError:
+            pass
+
     try:
         return datetime.strptime(value, "%d.%m.%Y").date()
     except ValueError:
@@ -440,43 +521,43 @@ def parse_date(value: str):
             )
             return None
 
+def parse_amount(value: str) -> float:
+    """Parse a DBO amount such as ``1234.56``; anything unusual goes through ``flt``."""
+    if not value:
+        return 0.0
+
+    try:
+        return float(value)
+    except ValueError:
+        # Thousands separators and garbage are handled the way Frappe does
+        from frappe.utils import flt
+
+        return flt(value)
+
 def parse_dbo(content: str):
     """Parse DBO formatted bank statement content into transactions."""
     # This is a placeholder implementation. The actual parsing logic will depend on the DBO format specification.
     # For demonstration, let's assume we have a simple parser that extracts transactions based on known tags.
 
-    from frappe.utils import flt
-
-    lines = [ln.strip() for ln in content.splitlines() if ln.strip()]
-
     header = {}
     docs = []
     current_doc = None
     in_account_section = False
 
-    for line in lines:
-        if line == "SECTIONACCOUNTSTART":
-            in_account_section = True
-            continue
+    if "\n" not in content and "\r" in content:
+        # Old Mac-style line endings
+        content = content.replace("\r", "\n")
 
-        if line == "SECTIONACCOUNTSTOP":
-            in_account_section = False
-            continue
-
-        if line == "DocStart":
-            current_doc = {}
-            continue
+    # One regex pass over the whole content; each match is either a marker line
+    # or a key=value line, everything else is skipped by the regex engine
+    for match in DBO_LINE_RE.finditer(content):
+        kind = match.lastindex
 
-        if line == "DocEnd":
-            if current_doc:
-                docs.append(current_doc)
-                current_doc = None
-            continue
-
-        if "=" in line:
-            key, value = line.split("=", 1)
-            key = key.strip().upper()
-            value = value.strip()
+        if kind == DBO_KEY_VALUE:
+            # Interned: all documents share one copy of each field name, and lookups
+            # with the literal keys below hit the identity fast path
+            key = sys.intern(match[5].strip().upper())
+            value = match[6].strip()
 
             if in_account_section:
                 # Account-level fields (ACCOUNT, STARTREST, STOPREST, CURRCODE, etc.)
@@ -490,6 +571,20 @@ def parse_dbo(content: str):
                 # Global header fields (BEGINDATE, ENDDATE)
                 header[key] = value
 
+        elif kind == DBO_DOC_START:
+            current_doc = {}
+
+        elif kind == DBO_DOC_END:
+            if current_doc:
+                docs.append(current_doc)
+                current_doc = None
+
+        elif kind == DBO_SECTION_START:
+            in_account_section = True
+
+        elif kind == DBO_SECTION_STOP:
+            in_account_section = False
+
     """
     Convert parsed document blocks into a list of transaction dicts ready
     to be converted into Bank Transaction documents.
@@ -510,50 +605,53 @@ def parse_dbo(content: str):
     - cp_bank_bic
     """
     account_iban = header.get("ACCOUNT")
-    opening_balance = flt(header.get("STARTREST") or 0)
-    closing_balance_bank = flt(header.get("STOPREST") or 0)
+    opening_balance = parse_amount(header.get("STARTREST"))
+    closing_balance_bank = parse_amount(header.get("STOPREST"))
     begin_date_str = header.get("BEGINDATE")
     end_date_str = header.get("ENDDATE")
-    currency_code = (header.get("CURRCODE") or "").strip() or None
+    currency_code = header.get("CURRCODE") or None
 
     transactions: list[dict] = []
-    running_balance = opening_balance
+    # Balance is kept in whole cents so that long statements do not accumulate float error
+    running_balance_cents = round(opening_balance * 100)
     from_date = None
     to_date = None
 
     for doc in docs:
-        # Raw fields from statement
-        document_number = (doc.get("DOCUMENTNUMBER") or "").strip()
-        document_date_str = (doc.get("DOCUMENTDATE") or "").strip()
-        date_written_str = (doc.get("DATEWRITTEN") or "").strip()
+        # Raw fields from statement (values are already stripped by the parser)
+        g = doc.get
+        document_number = g("DOCUMENTNUMBER", "")
+        document_date_str = g("DOCUMENTDATE", "")
+        date_written_str = g("DATEWRITTEN", "")
 
         posting_date = parse_date(document_date_str or date_written_str)
 
-        amount = flt(doc.get("AMOUNT") or 0)
+        amount = parse_amount(g("AMOUNT"))
 
-        payer_account = (doc.get("PAYERACCOUNT") or "").strip()
-        receiver_account = (doc.get("RECEIVERACCOUNT") or "").strip()
+        payer_account = g("PAYERACCOUNT", "")
+        receiver_account = g("RECEIVERACCOUNT", "")
 
-        payer_name = (doc.get("PAYER") or "").strip()
-        receiver_name = (doc.get("RECEIVER") or "").strip()
+        payer_name = g("PAYER", "")
+        receiver_name = g("RECEIVER", "")
 
-        payer_fcode = (doc.get("PAYERFCODE") or "").strip()
-        receiver_fcode = (doc.get("RECEIVERFCODE") or "").strip()
+        payer_fcode = g("PAYERFCODE", "")
+        receiver_fcode = g("RECEIVERFCODE", "")
 
-        payer_bank = (doc.get("PAYERBANK") or "").strip()
-        receiver_bank = (doc.get("RECEIVERBANK") or "").strip()
+        payer_bank = g("PAYERBANK", "")
+        receiver_bank = g("RECEIVERBANK", "")
 
-        payer_bank_bic = (doc.get("PAYERBANKBIC") or "").strip()
-        receiver_bank_bic = (doc.get("RECEIVERBANKBIC") or "").strip()
+        payer_bank_bic = g("PAYERBANKBIC", "")
+        receiver_bank_bic = g("RECEIVERBANKBIC", "")
 
-        oper_type = (doc.get("OPERTYPE") or "").strip()
-        transaction_code = (doc.get("TRANSACTIONCODE") or "").strip()
+        oper_type = g("OPERTYPE", "")
+        transaction_code = g("TRANSACTIONCODE", "")
 
-        base_ground = (doc.get("GROUND") or "").strip()
+        base_ground = g("GROUND", "")
 
         deposit = 0.0
         withdrawal = 0.0
         cp_role = ""
+        cp_labels = None
         cp_name = ""
         cp_account = ""
         cp_idno = ""
@@ -561,25 +659,29 @@ def parse_dbo(content: str):
         cp_bank_bic = ""
 
         # Direction: if our account is payer -> withdrawal, if receiver -> deposit
-        if account_iban and payer_account == account_iban and amount:
-            withdrawal = amount
-            running_balance -= amount
-            cp_role = "Receiver"
-            cp_name = receiver_name
-            cp_account = receiver_account
-            cp_idno = receiver_fcode
-            cp_bank = receiver_bank
-            cp_bank_bic = receiver_bank_bic
-
-        elif account_iban and receiver_account == account_iban and amount:
-            deposit = amount
-            running_balance += amount
-            cp_role = "Payer"
-            cp_name = payer_name
-            cp_account = payer_account
-            cp_idno = payer_fcode
-            cp_bank = payer_bank
-            cp_bank_bic = payer_bank_bic
+        # (zero amounts and statements without our account have no direction)
+        if amount and account_iban:
+            if payer_account == account_iban:
+                withdrawal = amount
+                running_balance_cents -= round(amount * 100)
+                cp_role = "Receiver"
+                cp_labels = DBO_COUNTERPARTY_LABELS[cp_role]
+                cp_name = receiver_name
+                cp_account = receiver_account
+                cp_idno = receiver_fcode
+                cp_bank = receiver_bank
+                cp_bank_bic = receiver_bank_bic
+
+            elif receiver_account == account_iban:
+                deposit = amount
+                running_balance_cents += round(amount * 100)
+                cp_role = "Payer"
+                cp_labels = DBO_COUNTERPARTY_LABELS[cp_role]
+                cp_name = payer_name
+                cp_account = payer_account
+                cp_idno = payer_fcode
+                cp_bank = payer_bank
+                cp_bank_bic = payer_bank_bic
 
         # Track min/max posting date
         if posting_date:
@@ -599,54 +701,40 @@ def parse_dbo(content: str):
         # 8) "<Receiver/Payer> Account: ..."
         # 9) "<Receiver/Payer> Bank: ..."
         # 10) "<Receiver/Payer> Bank BIC: ..."
-        desc_lines = []
-
-        if base_ground:
-            desc_lines.append(base_ground)
-
-        # Empty line
-        if desc_lines:
-            desc_lines.append("")
-
-        # Amount
-        if amount:
-            desc_lines.append(f"Amount: {amount:.2f}")
-
-        # Document number
-        if document_number:
-            desc_lines.append(f"Document Number: {document_number}")
-
-        # Date written (string as in statement)
-        if date_written_str:
-            desc_lines.append(f"Date Written: {date_written_str}")
-
-        # Counterparty block
-        if cp_role and (cp_name or cp_account or cp_idno or cp_bank or cp_bank_bic):
-            # Name
-            if cp_name:
-                desc_lines.append(f"{cp_role}: {cp_name}")
-            # IDNO
-            if cp_idno:
-                desc_lines.append(f"{cp_role} IDNO: {cp_idno}")
-            # Account
-            if cp_account:
-                desc_lines.append(f"{cp_role} Account: {cp_account}")
-            # Bank
-            if cp_bank:
-                desc_lines.append(f"{cp_role} Bank: {cp_bank}")
-            # Bank BIC
-            if cp_bank_bic:
-                desc_lines.append(f"{cp_role} Bank BIC: {cp_bank_bic}")
+        desc_lines = [
+            part
+            for part in (
+                base_ground or None,
+                # Empty line
+                "" if base_ground else None,
+                f"Amount: {amount:.2f}" if amount else None,
+                f"Document Number: {document_number}" if document_number else None,
+                # Date written (string as in statement)
+                f"Date Written: {date_written_str}" if date_written_str else None,
+            )
+            if part is not None
+        ]
+
+        # Counterparty block (cp_role is only set when a direction matched)
+        if cp_role:
+            desc_lines.extend(
+                label % value
+                for label, value in zip(cp_labels, (cp_name, cp_idno, cp_account, cp_bank, cp_bank_bic), strict=True)
+                if value
+            )
 
         # Optional technical info
         if oper_type or transaction_code:
-            tech_parts = []
-            if oper_type:
-                tech_parts.append(f"OpType: {oper_type}")
-            if transaction_code:
-                tech_parts.append(f"TxnCode: {transaction_code}")
-            if tech_parts:
-                desc_lines.append(" / ".join(tech_parts))
+            desc_lines.append(
+                " / ".join(
+                    part
+                    for part in (
+                        f"OpType: {oper_type}" if oper_type else None,
+                        f"TxnCode: {transaction_code}" if transaction_code else None,
+                    )
+                    if part
+                )
+            )
 
         description = "\n".join(desc_lines)
 
@@ -655,7 +743,7 @@ def parse_dbo(content: str):
             "description": description,
             "deposit": deposit,
             "withdrawal": withdrawal,
-            "bank_balance": running_balance,
+            "bank_balance": running_balance_cents / 100,
             "reference_number": document_number,
             "currency": currency_code,
             "cp_role": cp_role,
@@ -676,46 +764,113 @@ def parse_dbo(content: str):
 
     return transactions
 
-def resolve_party_by_idno(tx: dict) -> tuple[str, str]:
-	"""Resolve party_type and party name used in CSV based on IDNO.
+def iter_dbo_csv_rows(transactions: list[dict], bank_account: str):
+	"""Yield CSV rows (matching the ``convert_dbo_to_csv`` headers) for parsed DBO transactions."""
+	from frappe.utils import cstr
 
-	This follows the same rules as ``_assign_party_by_idno`` but instead of
-	mutating a Bank Transaction document it just returns the match so that
-	we can include it when generating the CSV.
-	"""
-	cp_idno = (tx.get("cp_idno") or "").strip()
-	if not cp_idno:
-		return "", ""
+	customers_by_idno, suppliers_by_idno = get_parties_by_idno(transactions)
+
+	for txn in transactions:
+		# Date & currency safe formatting
+		dt = txn["date"]
+		date_str = cstr(dt) if dt else ""
+
+		# Party resolution based on IDNO
+		party_type, party = resolve_party_by_idno(txn, customers_by_idno, suppliers_by_idno)
+
+		# Counterparty account goes either to the account number or to the IBAN column
+		cp_account_raw = txn["cp_account"]
+		is_iban = is_iban_valid(cp_account_raw)
+
+		yield (
+			date_str,
+			txn["deposit"] or 0,
+			txn["withdrawal"] or 0,
+			txn["description"].replace("\r\n", "\n"),
+			txn["reference_number"],
+			bank_account,
+			txn["currency"],
+			party_type or "",
+			party or "",
+			txn["cp_name"],
+			"" if is_iban else cp_account_raw,
+			cp_account_raw if is_iban else "",
+		)
 
+
+def get_parties_by_idno(transactions: list[dict]) -> tuple[dict, dict]:
+	"""Preload Customer and Supplier names for all counterparty IDNOs in a statement.
+
+	Incoming payments are matched against Customers and outgoing payments
+	against Suppliers, so only the IDNOs relevant for each direction are
+	queried. Returns ``(customers_by_idno, suppliers_by_idno)``.
+	"""
 	try:
-		settings = frappe.get_single("Moldova Banking Settings")
+		settings = frappe.get_cached_doc("Moldova Banking Settings")
 	except Exception:
-		return "", ""
+		return {}, {}
 
 	customer_idno_field = (getattr(settings, "customer_idno_field", None) or "").strip()
 	supplier_idno_field = (getattr(settings, "supplier_idno_field", None) or "").strip()
 
+	customer_idnos = set()
+	supplier_idnos = set()
+	for tx in transactions:
+		cp_idno = tx["cp_idno"]
+		if not cp_idno:
+			continue
+		if tx["deposit"] and not tx["withdrawal"]:
+			customer_idnos.add(cp_idno)
+		elif tx["withdrawal"] and not tx["deposit"]:
+			supplier_idnos.add(cp_idno)
+
+	return (
+		_get_party_names_by_idno("Customer", customer_idno_field, customer_idnos),
+		_get_party_names_by_idno("Supplier", supplier_idno_field, supplier_idnos),
+	)
+
+
+def _get_party_names_by_idno(doctype: str, idno_field: str, idnos: set) -> dict:
+	if not idno_field or not idnos:
+		return {}
+
+	parties = frappe.get_all(
+		doctype,
+		filters={idno_field: ["in", list(idnos)]},
+		fields=["name", idno_field],
+	)
+
+	# Keep the first match per IDNO, same as a ``limit=1`` lookup would
+	names_by_idno = {}
+	for row in parties:
+		names_by_idno.setdefault(row.get(idno_field), row.name)
+
+	return names_by_idno
+
+
+def resolve_party_by_idno(tx: dict, customers_by_idno: dict, suppliers_by_idno: dict) -> tuple[str, str]:
+	"""Resolve party_type and party name used in CSV based on IDNO.
+
+	This follows the same rules as ``_assign_party_by_idno`` but instead of
+	mutating a Bank Transaction document it just returns the match so that
+	we can include it when generating the CSV. Party names are looked up in
+	the maps preloaded by ``get_parties_by_idno``.
+	"""
+	cp_idno = tx["cp_idno"]
+	if not cp_idno:
+		return "", ""
+
 	# Incoming payment -> Customer
-	if tx.get("deposit") and not tx.get("withdrawal") and customer_idno_field:
-		customer = frappe.get_all(
-			"Customer",
-			filters={customer_idno_field: cp_idno},
-			pluck="name",
-			limit=1,
-		)
+	if tx["deposit"] and not tx["withdrawal"]:
+		customer = customers_by_idno.get(cp_idno)
 		if customer:
-			return "Customer", customer[0]
+			return "Customer", customer
 
 	# Outgoing payment -> Supplier
-	if tx.get("withdrawal") and not tx.get("deposit") and supplier_idno_field:
-		supplier = frappe.get_all(
-			"Supplier",
-			filters={supplier_idno_field: cp_idno},
-			pluck="name",
-			limit=1,
-		)
+	if tx["withdrawal"] and not tx["deposit"]:
+		supplier = suppliers_by_idno.get(cp_idno)
 		if supplier:
-			return "Supplier", supplier[0]
+			return "Supplier", supplier
 
 	return "", ""
 
@@ -724,13 +879,5 @@ def is_iban_valid(iban_string):
     Checks if a string is a valid IBAN format using a regular expression.
     Returns True if valid, False otherwise.
     """
-    # Remove spaces and convert to uppercase for consistent matching
-    cleaned_iban = iban_string.replace(" ", "").upper()
-
-    # A general IBAN regex pattern (adjust for more specific country rules if needed)
-    iban_pattern = r"^[A-Z]{2}\d{2}[A-Z0-9]{11,30}$"
-
-    if re.fullmatch(iban_pattern, cleaned_iban):
-        return True
-    else:
-        return False
\ No newline at end of file
+    # Remove whitespace and convert to uppercase for consistent matching
+    return IBAN_RE.fullmatch(iban_string.translate(IBAN_STRIP_TABLE).upper()) is not None
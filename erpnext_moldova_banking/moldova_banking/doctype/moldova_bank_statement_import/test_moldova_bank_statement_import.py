@@ -1,9 +1,104 @@
 # Copyright (c) 2025, Evgheni Nemerenco and Contributors
 # See license.txt
 
+from datetime import date
+
 # import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from erpnext_moldova_banking.moldova_banking.doctype.moldova_bank_statement_import.moldova_bank_statement_import import (
+	decode_dbo_content,
+	parse_date,
+	parse_dbo,
+)
+
+ACCOUNT = "MD24AG000225100013104168"
+
+DBO_CONTENT = "\n".join(
+	(
+		"BEGINDATE=01.01.2025",
+		"ENDDATE=31.01.2025",
+		"SECTIONACCOUNTSTART",
+		f"ACCOUNT={ACCOUNT}",
+		"STARTREST=1000.50",
+		"CURRCODE=MDL",
+		"SECTIONACCOUNTSTOP",
+		"DocStart",
+		"DOCUMENTNUMBER=123",
+		"DOCUMENTDATE=05.01.2025",
+		"AMOUNT=100.25",
+		f"PAYERACCOUNT={ACCOUNT}",
+		"  receiver = Vendor SRL ",
+		"RECEIVERACCOUNT=MD11AG000000022512345678",
+		"RECEIVERFCODE=1003600000002",
+		"GROUND=Plata = servicii",
+		"DocEnd",
+		"DocStart",
+		"DocEnd",
+		"DocStart",
+		"DOCUMENTNUMBER=124",
+		"DOCUMENTDATE=06.01.2025",
+		"AMOUNT=50",
+		"PAYERACCOUNT=12345",
+		"PAYER=Client",
+		f"RECEIVERACCOUNT={ACCOUNT}",
+		"GROUND=Achitare",
+		"DocEnd",
+	)
+)
+
 
 class TestMoldovaBankStatementImport(FrappeTestCase):
-	pass
+	def test_parse_dbo_markers_and_fields(self):
+		withdrawal, deposit = parse_dbo(DBO_CONTENT)
+
+		# Empty DocStart/DocEnd blocks are skipped
+		self.assertEqual(withdrawal["reference_number"], "123")
+		self.assertEqual(withdrawal["date"], date(2025, 1, 5))
+		self.assertEqual(withdrawal["currency"], "MDL")
+		self.assertEqual(withdrawal["withdrawal"], 100.25)
+		self.assertEqual(withdrawal["deposit"], 0)
+
+		# Keys are case-insensitive and stripped; values split at the first "="
+		self.assertEqual(withdrawal["cp_role"], "Receiver")
+		self.assertEqual(withdrawal["cp_name"], "Vendor SRL")
+		self.assertEqual(withdrawal["cp_idno"], "1003600000002")
+		self.assertTrue(withdrawal["description"].startswith("Plata = servicii\n\nAmount: 100.25\n"))
+
+		self.assertEqual(deposit["cp_role"], "Payer")
+		self.assertEqual(deposit["cp_name"], "Client")
+		self.assertEqual(deposit["deposit"], 50)
+
+	def test_parse_dbo_line_endings(self):
+		expected = parse_dbo(DBO_CONTENT)
+
+		self.assertEqual(parse_dbo(DBO_CONTENT.replace("\n", "\r\n")), expected)
+		self.assertEqual(parse_dbo(DBO_CONTENT.replace("\n", "\r")), expected)
+
+	def test_decode_dbo_content(self):
+		# Legacy exports are Windows-1251 bytes
+		self.assertEqual(decode_dbo_content("GROUND=Плата".encode("cp1251")), "GROUND=Плата")
+		# A UTF-8 BOM must not end up glued to the first key
+		self.assertEqual(decode_dbo_content("\ufeffBEGINDATE=01.01.2025"), "BEGINDATE=01.01.2025")
+		self.assertEqual(parse_dbo(decode_dbo_content("\ufeff" + DBO_CONTENT)), parse_dbo(DBO_CONTENT))
+
+	def test_parse_dbo_bank_balance_rounding(self):
+		docs = "\n".join(
+			f"DocStart\nDOCUMENTNUMBER={n}\nAMOUNT=0.10\nRECEIVERACCOUNT={ACCOUNT}\nDocEnd" for n in range(10)
+		)
+		content = f"SECTIONACCOUNTSTART\nACCOUNT={ACCOUNT}\nSTARTREST=0.20\nSECTIONACCOUNTSTOP\n{docs}"
+
+		transactions = parse_dbo(content)
+
+		# Summing 0.10 as floats drifts (0.30000000000000004, ...); the balance is kept in cents
+		self.assertEqual(
+			[txn["bank_balance"] for txn in transactions],
+			[0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2],
+		)
+
+	def test_parse_date(self):
+		self.assertEqual(parse_date("05.01.2025"), date(2025, 1, 5))
+		self.assertEqual(parse_date("2025-01-05"), date(2025, 1, 5))
+		# Malformed parts are rejected, not read by int()
+		self.assertIsNone(parse_date("+5.01.2025"))
+		self.assertIsNone(parse_date("05.01.2_25"))
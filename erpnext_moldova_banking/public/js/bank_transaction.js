@@ -6,4 +6,14 @@ frappe.realtime.on("bank_transaction_reload", (data) => {
     ) {
         cur_frm.reload_doc();
     }
-});
\ No newline at end of file
+});
+
+frappe.realtime.on("bank_transactions_reload", (data) => {
+    if (
+        cur_frm &&
+        cur_frm.doctype === data.doctype &&
+        data.names.includes(cur_frm.doc.name)
+    ) {
+        cur_frm.reload_doc();
+    }
+});
@@ -1,7 +1,26 @@
-from pydoc import doc
+import re
+import sys
+
 import frappe
 from frappe.utils import flt
 
+# Characters dropped by normalize_string: bytes for the ASCII fast path, and a
+# regex for other text (a regex sub beats str.translate with deletions there)
+NORMALIZE_STRIP_BYTES = b" \n\r"
+NORMALIZE_STRIP_RE = re.compile(r"[ \n\r]+")
+
+# ASCII-only lowercasing for the bytes fast path of normalize_string
+NORMALIZE_ASCII_LOWER_TABLE = bytes.maketrans(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZ", b"abcdefghijklmnopqrstuvwxyz"
+)
+
+# Savepoint around the insert, submit and reconcile of an automated voucher
+AUTOMATION_SAVEPOINT = "bank_transaction_automation"
+
+# Automation rule index per site:
+# {site: (settings.modified, {(company, bank): {first character: [(rule idx, pattern)]}})}
+_RULE_INDEX = {}
+
 
 def normalize_string(value: str) -> str:
     """
@@ -10,17 +29,74 @@ def normalize_string(value: str) -> str:
     if not value:
         return ""
 
-    return (
-        value.replace(" ", "")
-        .replace("\n", "")
-        .replace("\r", "")
-        .lower()
-    )
+    # Most bank descriptions are plain ASCII: strip and lowercase them in one bytes pass
+    if value.isascii():
+        return (
+            value.encode("ascii")
+            .translate(NORMALIZE_ASCII_LOWER_TABLE, NORMALIZE_STRIP_BYTES)
+            .decode("ascii")
+        )
+
+    return NORMALIZE_STRIP_RE.sub("", value).lower()
+
+
+def get_rule_index(settings) -> dict:
+    """
+    Index enabled automation rules by company and bank, then by the first
+    character of their normalized pattern.
+
+    Each bucket lists (rule index, normalized pattern) in declaration order, so
+    a description only has to be checked against rules of its own company and
+    bank sharing its first character. Rules only change when the settings are
+    saved, so the index is built once per settings revision instead of once
+    per transaction.
+    """
+    site = getattr(frappe.local, "site", None)
+    modified = str(settings.modified)
+
+    cached = _RULE_INDEX.get(site)
+    if cached and cached[0] == modified:
+        return cached[1]
+
+    index = {}
+    for idx, rule in enumerate(settings.automation_rules):
+        if rule.disabled:
+            continue
+
+        normalized_pattern = normalize_string(rule.description_pattern)
+        if not normalized_pattern:
+            continue
+
+        rules_by_first_char = index.setdefault((rule.company, rule.bank), {})
+        rules_by_first_char.setdefault(normalized_pattern[0], []).append((idx, normalized_pattern))
+
+    _RULE_INDEX[site] = (modified, index)
+    return index
 
 
 def handle_bank_transaction(doc, method=None):
-    # 1. Load settings
-    settings = frappe.get_single("Moldova Banking Settings")
+    """
+    on_submit hook for Bank Transaction.
+
+    While Moldova Bank Statement Import runs, submitted transactions are only
+    collected in `frappe.local.pending_bank_transactions` once their import row
+    is committed; they are processed in one background job after the import
+    (see `flush_bank_transactions`).
+    """
+    pending = getattr(frappe.local, "pending_bank_transactions", None)
+    if pending is not None:
+        if frappe.get_cached_doc("Moldova Banking Settings").enable_automation:
+            # A row rolled back after this hook never reaches the job
+            name = doc.name
+            frappe.db.after_commit.add(lambda: pending.append(name))
+        return
+
+    automate_bank_transaction(doc)
+
+
+def automate_bank_transaction(doc):
+    # 1. Load settings (cached across requests; Frappe invalidates it when the settings are saved)
+    settings = frappe.get_cached_doc("Moldova Banking Settings")
 
     if not settings.enable_automation:
         return
@@ -29,46 +105,59 @@ def handle_bank_transaction(doc, method=None):
     if not doc.company or not doc.bank_account or not doc.description:
         return
 
-    normalized_description = normalize_string(doc.description)
+    # Bank Account and its ledger Account are the same for every rule (and every
+    # line of an import), so they come from the document cache; only the
+    # fields used below are read
+    ba = frappe.get_cached_value("Bank Account", doc.bank_account, ["bank", "account"], as_dict=True)
+    if not ba or not ba.account:
+        return
 
-    # 2. Iterate over enabled clearing rules
-    for rule in settings.automation_rules:
-        if rule.disabled:
-            continue
+    # 2. Rules of this company & bank
+    rules_by_first_char = get_rule_index(settings).get((doc.company, ba.bank))
+    if not rules_by_first_char:
+        return
 
-        # 3. Match company & bank
-        if rule.company != doc.company:
-            continue
+    # 3. ... whose pattern starts the description, in declaration order
+    normalized_description = normalize_string(doc.description)
+    rules = [
+        settings.automation_rules[idx]
+        for idx, normalized_pattern in rules_by_first_char.get(normalized_description[:1], ())
+        if normalized_description.startswith(normalized_pattern)
+    ]
+    if not rules:
+        return
 
-        ba = frappe.get_doc("Bank Account", doc.bank_account)
-        if rule.bank != ba.bank:
-            continue
+    ba_account = frappe.get_cached_value("Account", ba.account, ["name", "account_currency"], as_dict=True)
+    if not ba_account:
+        return
 
-        ba_account = frappe.get_doc("Account", ba.account)
+    # Second accounts of the matching Journal Entry rules, loaded in one query
+    second_account_names = {
+        rule.second_account
+        for rule in rules
+        if rule.document_type == "Journal Entry" and rule.second_account
+    }
+    second_accounts = {}
+    if second_account_names:
+        for account in frappe.get_all(
+            "Account",
+            filters={"name": ["in", list(second_account_names)]},
+            fields=["name", "account_currency"],
+        ):
+            second_accounts[account.name] = account
 
+    for rule in rules:
+        second_account = None
         if rule.document_type == "Journal Entry" and rule.second_account:
-            second_account = frappe.get_doc("Account", rule.second_account)
+            second_account = second_accounts.get(rule.second_account)
+            if not second_account:
+                continue
 
         # Currency guard
         if second_account and ba_account.account_currency != second_account.account_currency:
             continue
 
-        if not rule.description_pattern:
-            continue
-
-        # 4. Normalize pattern
-        normalized_pattern = normalize_string(rule.description_pattern)
-        if not normalized_pattern:
-            continue
-
-        # Trim transaction description to pattern length
-        candidate = normalized_description[: len(normalized_pattern)]
-
-        # 5. Compare
-        if candidate != normalized_pattern:
-            continue
-
-        # 6. Match found → create Payment Entry
+        # 4. Match found → create Payment Entry or Journal Entry
         if rule.document_type == "Payment Entry":
             create_payment_entry_from_transaction(settings, doc, rule, ba_account)
         elif rule.document_type == "Journal Entry":
@@ -118,48 +207,92 @@ def create_payment_entry_from_transaction(settings, transaction, rule, ba_accoun
     )
 
     # Avoid duplicate Payment Entries (best-effort guard)
-    if frappe.db.exists(
-        "Payment Entry",
-        {
-            "reference_no": pe.reference_no,
-            "reference_date": pe.reference_date,
-            "received_amount": pe.received_amount,
-            "company": pe.company,
-        },
-    ):
+    if _payment_entry_exists(pe):
         return
 
-    # Create PE safely
+    # Create, submit and reconcile PE under one savepoint: if any step fails,
+    # all of them are rolled back, so no orphan PE is left next to the Bank Transaction
+    frappe.db.savepoint(AUTOMATION_SAVEPOINT)
+    step = "create"
     try:
         pe.insert(ignore_permissions=True)
-        saved = True
-    except Exception:
-        # Log error
-        frappe.log_error(
-            frappe.get_traceback(),
-            f"Auto-create Payment Entry failed for Bank Transaction {transaction.name}",
-        )
-        return
 
-    # Submit PE safely
-    try:
-        if saved and settings.automation_submit:
+        if settings.automation_submit:
+            step = "submit"
             pe.submit()
+
+            # Reconcile only if PE is submitted and auto-reconcile enabled
+            if settings.automation_autoreconcile:
+                step = "reconcile"
+                _reconcile(pe.doctype, pe, transaction.name, amount)
     except Exception:
-        # Log error but do NOT reconcile
-        frappe.log_error(
-            frappe.get_traceback(),
-            f"Auto-submit Payment Entry failed for Bank Transaction {transaction.name}",
+        frappe.db.rollback(save_point=AUTOMATION_SAVEPOINT)
+        _log_automation_error(f"Auto-{step} Payment Entry failed for Bank Transaction {transaction.name}")
+        return
+
+    _remember_payment_entry(pe)
+
+
+def _payment_entry_exists(pe):
+    """
+    Check whether a Payment Entry with the same reference and amount exists.
+
+    During Data Import and inside `process_bank_transactions` the existing
+    entries are loaded once per (company, reference_date) and kept for the
+    rest of the job. Entries created by the automation are added by
+    `_remember_payment_entry` once they are committed, so later lines of the
+    same import see them too.
+    """
+    index = getattr(frappe.local, "automation_payment_entry_keys", None)
+    if index is None and frappe.flags.in_import:
+        index = frappe.local.automation_payment_entry_keys = {}
+
+    if index is None:
+        return frappe.db.exists(
+            "Payment Entry",
+            {
+                "reference_no": pe.reference_no,
+                "reference_date": pe.reference_date,
+                "received_amount": pe.received_amount,
+                "company": pe.company,
+            },
         )
+
+    scope = (pe.company, pe.reference_date)
+    keys = index.get(scope)
+    if keys is None:
+        keys = index[scope] = {
+            _payment_entry_key(row.reference_no, row.received_amount)
+            for row in frappe.get_all(
+                "Payment Entry",
+                filters={"company": pe.company, "reference_date": pe.reference_date},
+                fields=["reference_no", "received_amount"],
+            )
+        }
+
+    return _payment_entry_key(pe.reference_no, pe.received_amount) in keys
+
+
+def _payment_entry_key(reference_no, received_amount):
+    # Same matching as the database collation: case-insensitive, trailing spaces ignored
+    return (reference_no or "").strip().lower(), flt(received_amount)
+
+
+def _remember_payment_entry(pe):
+    """
+    Add a saved Payment Entry to the index used by `_payment_entry_exists`.
+
+    The key is added on commit: a rollback drops the pending callback, so an
+    entry that never reached the database does not hide later lines.
+    """
+    index = getattr(frappe.local, "automation_payment_entry_keys", None)
+    if index is None:
         return
 
-    # Reconcile only if PE is submitted and auto-reconcile enabled
-    if (
-        settings.automation_submit
-        and settings.automation_autoreconcile
-        and pe.docstatus == 1
-    ):
-        reconcile_pe_and_bt(pe, transaction)
+    keys = index.get((pe.company, pe.reference_date))
+    if keys is not None:
+        key = _payment_entry_key(pe.reference_no, pe.received_amount)
+        frappe.db.after_commit.add(lambda: keys.add(key))
 
 
 def create_journal_entry_from_transaction(settings, transaction, rule, ba_account, second_account):
@@ -176,7 +309,11 @@ def create_journal_entry_from_transaction(settings, transaction, rule, ba_accoun
     je.mode_of_payment = settings.automation_mode_of_payment
 
     amount = flt(transaction.deposit or transaction.withdrawal)
-    company = frappe.get_doc("Company", transaction.company)
+    # Second account rows fall back to the Company default Cost Center
+    second_cost_center = (
+        rule.cost_center
+        or frappe.get_cached_value("Company", transaction.company, "cost_center")
+    )
 
     # Debit / Credit lines
     if transaction.deposit:
@@ -195,12 +332,12 @@ def create_journal_entry_from_transaction(settings, transaction, rule, ba_accoun
                 "account": second_account.name,
                 "credit_in_account_currency": amount,
                 "account_currency": second_account.account_currency,
-                "cost_center": rule.cost_center or company.cost_center,
+                "cost_center": second_cost_center,
             }
         
         if je.voucher_type == "Bank Entry" and transaction.party_type and transaction.party:
-            row.party_type = transaction.party_type
-            row.party = transaction.party
+            row["party_type"] = transaction.party_type
+            row["party"] = transaction.party
 
         je.append(
             "accounts",
@@ -221,52 +358,162 @@ def create_journal_entry_from_transaction(settings, transaction, rule, ba_accoun
                 "account": second_account.name,
                 "debit_in_account_currency": amount,
                 "account_currency": second_account.account_currency,
-                "cost_center": rule.cost_center or company.cost_center,
+                "cost_center": second_cost_center,
             }
         
         # if je.voucher_type == "Bank Entry" and transaction.party_type and transaction.party:
-        #     row.party_type = transaction.party_type
-        #     row.party = transaction.party
+        #     row["party_type"] = transaction.party_type
+        #     row["party"] = transaction.party
 
         je.append(
             "accounts",
             row,
         )
 
-    # Create JE safely
+    # Create, submit and reconcile JE under one savepoint: if any step fails,
+    # all of them are rolled back, so no orphan JE is left next to the Bank Transaction
+    frappe.db.savepoint(AUTOMATION_SAVEPOINT)
+    step = "create"
     try:
         je.insert(ignore_permissions=True)
-        saved = True
+
+        if settings.automation_submit:
+            step = "submit"
+            je.submit()
+
+            # Reconcile only if JE is submitted and auto-reconcile enabled
+            if settings.automation_autoreconcile:
+                step = "reconcile"
+                _reconcile(je.doctype, je, transaction.name, amount)
     except Exception:
-        # Log error
-        frappe.log_error(
-            frappe.get_traceback(),
-            f"Auto-create Journal Entry failed for Bank Transaction {transaction.name}",
+        frappe.db.rollback(save_point=AUTOMATION_SAVEPOINT)
+        _log_automation_error(f"Auto-{step} Journal Entry failed for Bank Transaction {transaction.name}")
+
+
+def _reconcile(voucher_type, voucher, bank_transaction, allocated_amount):
+    if voucher_type == "Payment Entry":
+        reconcile_pe_and_bt(voucher, bank_transaction, allocated_amount)
+    else:
+        reconcile_je_and_bt(voucher, bank_transaction, allocated_amount)
+
+
+def _log_automation_error(title):
+    """
+    Log the exception being handled.
+
+    Inside `process_bank_transactions` only the first occurrence of each
+    exception class gets an Error Log; repeats of a systemic failure go to the
+    app log file instead of one Error Log per transaction.
+    """
+    logged = getattr(frappe.local, "automation_logged_errors", None)
+
+    if logged is not None:
+        error_class = sys.exc_info()[0]
+        if error_class in logged:
+            frappe.logger("erpnext_moldova_banking").error(title, exc_info=True)
+            return
+        logged.add(error_class)
+
+    frappe.log_error(frappe.get_traceback(), title)
+
+
+def flush_bank_transactions():
+    """
+    Enqueue the Bank Transactions collected during a statement import as one background job.
+    """
+    pending = getattr(frappe.local, "pending_bank_transactions", None)
+    frappe.local.pending_bank_transactions = None
+
+    if pending:
+        frappe.enqueue(
+            "erpnext_moldova_banking.utils.bank_transaction_automation.process_bank_transactions",
+            queue="long",
+            names=pending,
         )
-        return
 
-    # Submit JE safely
+
+def process_bank_transactions(names):
+    """
+    Background job: run automation for the given submitted Bank Transactions.
+
+    Every transaction is committed on its own; a failing one is logged and
+    does not stop the rest of the batch. Open forms are told to reload with a
+    single realtime message at the end.
+    """
+    # A name can only be automated once per batch
+    names = list(dict.fromkeys(names))
+
+    reloaded = frappe.local.pending_bank_transaction_reloads = []
+    frappe.local.automation_logged_errors = set()
+    frappe.local.automation_payment_entry_keys = {}
+
     try:
-        if saved and settings.automation_submit:
-            je.submit()
-    except Exception:
-        # Log error but do NOT reconcile
-        frappe.log_error(
-            frappe.get_traceback(),
-            f"Auto-submit Journal Entry failed for Bank Transaction {transaction.name}",
+        for name in names:
+            try:
+                automate_bank_transaction(frappe.get_doc("Bank Transaction", name))
+                frappe.db.commit()
+            except Exception:
+                frappe.db.rollback()
+                _log_automation_error(f"Bank Transaction automation failed for {name}")
+    finally:
+        frappe.local.pending_bank_transaction_reloads = None
+        frappe.local.automation_logged_errors = None
+        frappe.local.automation_payment_entry_keys = None
+
+    if reloaded:
+        frappe.publish_realtime(
+            event="bank_transactions_reload",
+            message={
+                "doctype": "Bank Transaction",
+                "names": reloaded,
+            }
         )
+
+
+def notify_bank_transaction_reload(bt):
+    """
+    Tell open forms of a Bank Transaction to reload, or collect it for `process_bank_transactions`.
+    """
+    pending = getattr(frappe.local, "pending_bank_transaction_reloads", None)
+    if pending is not None:
+        pending.append(bt.name)
         return
-    
-    # Reconcile only if JE is submitted and auto-reconcile enabled
-    if (
-        settings.automation_submit
-        and settings.automation_autoreconcile
-        and je.docstatus == 1
-    ):
-        reconcile_je_and_bt(je, transaction)
+
+    frappe.publish_realtime(
+        event="bank_transaction_reload",
+        message={
+            "doctype": bt.doctype,
+            "name": bt.name,
+        }
+    )
+
+
+def _is_reconciled_with(voucher_type, voucher_name, bank_transaction_name):
+    """
+    Check whether a voucher is already linked to a Bank Transaction.
+
+    Both Payment Entries and Journal Entries are linked through the
+    `payment_entries` child table ("Bank Transaction Payments").
+    """
+    return frappe.db.exists(
+        "Bank Transaction Payments",
+        {
+            "parenttype": "Bank Transaction",
+            "parent": bank_transaction_name,
+            "payment_document": voucher_type,
+            "payment_entry": voucher_name,
+        },
+    )
 
 
-def reconcile_pe_and_bt(payment_entry, bank_transaction):
+def _resolve_name(doc_or_name):
+    """
+    Name of a document passed either by name or as a loaded document.
+    """
+    return doc_or_name if isinstance(doc_or_name, str) else doc_or_name.name
+
+
+def reconcile_pe_and_bt(payment_entry, bank_transaction, allocated_amount=None):
     """
     Reconcile a submitted Payment Entry with a submitted Bank Transaction.
 
@@ -279,41 +526,38 @@ def reconcile_pe_and_bt(payment_entry, bank_transaction):
     - Updates Bank Transaction.status to "Reconciled" (best-effort)
     """
 
-    # Reload fresh docs to ensure we work with full metadata and latest state
-    pe = (
-        frappe.get_doc("Payment Entry", payment_entry.name)
-        if hasattr(payment_entry, "name")
-        else frappe.get_doc("Payment Entry", payment_entry)
-    )
-    bt = (
-        frappe.get_doc("Bank Transaction", bank_transaction.name)
-        if hasattr(bank_transaction, "name")
-        else frappe.get_doc("Bank Transaction", bank_transaction)
-    )
+    pe_name = _resolve_name(payment_entry)
+    bt_name = _resolve_name(bank_transaction)
+
+    # Only the docstatus of the Payment Entry is needed; a document passed in is used as is
+    if isinstance(payment_entry, str):
+        pe_docstatus = frappe.db.get_value("Payment Entry", pe_name, "docstatus")
+    else:
+        pe_docstatus = payment_entry.docstatus
 
     # Preconditions
-    if pe.docstatus != 1:
+    if pe_docstatus != 1:
         return
-    if bt.docstatus != 1:
+
+    # Prevent duplicate reconciliation (indexed lookup, before loading any document)
+    if _is_reconciled_with("Payment Entry", pe_name, bt_name):
         return
 
-    # Prevent duplicate reconciliation by checking existing child rows
-    for row in bt.get("payment_entries") or []:
-        # ERPNext stores "Payment Entry" in payment_document; some setups may also store it in payment_type
-        if (
-            (row.get("payment_document") == "Payment Entry" or row.get("payment_type") == "Payment Entry")
-            and row.get("payment_entry") == pe.name
-        ):
-            return
+    # Always reload the Bank Transaction: the caller may be its own on_submit hook
+    bt = frappe.get_doc("Bank Transaction", bt_name)
+    if bt.docstatus != 1:
+        return
 
-    allocated_amount = flt(bt.deposit or bt.withdrawal)
+    # Callers that created the voucher already know the amount
+    if allocated_amount is None:
+        allocated_amount = flt(bt.deposit or bt.withdrawal)
 
     # Append reconciliation row (standard ERPNext v15 fieldnames)
     bt.append(
         "payment_entries",
         {
             "payment_document": "Payment Entry",
-            "payment_entry": pe.name,
+            "payment_entry": pe_name,
             "allocated_amount": allocated_amount,
         },
     )
@@ -326,59 +570,55 @@ def reconcile_pe_and_bt(payment_entry, bank_transaction):
 
     bt.save(ignore_permissions=True)
 
-    frappe.publish_realtime(
-        event="bank_transaction_reload",
-        message={
-            "doctype": bt.doctype,
-            "name": bt.name,
-        }
-    )
+    notify_bank_transaction_reload(bt)
 
 
-def reconcile_je_and_bt(journal_entry, bank_transaction):
+def reconcile_je_and_bt(journal_entry, bank_transaction, allocated_amount=None):
     """
     Reconcile a submitted Journal Entry with a submitted Bank Transaction.
 
     IMPORTANT:
     In ERPNext v15, reconciliation links are stored on the Bank Transaction itself
-    in the child table field `journal_entries` (child doctype: "Bank Transaction Journal Entries").
+    in the child table field `payment_entries` (child doctype: "Bank Transaction Payments"),
+    with payment_document = "Journal Entry".
 
     This function:
-    - Adds a row into Bank Transaction.journal_entries if not already present
+    - Adds a row into Bank Transaction.payment_entries if not already present
     - Updates Bank Transaction.status to "Reconciled" (best-effort)
     """
 
-    # Reload fresh docs to ensure we work with full metadata and latest state
-    je = (
-        frappe.get_doc("Journal Entry", journal_entry.name)
-        if hasattr(journal_entry, "name")
-        else frappe.get_doc("Journal Entry", journal_entry)
-    )
-    bt = (
-        frappe.get_doc("Bank Transaction", bank_transaction.name)
-        if hasattr(bank_transaction, "name")
-        else frappe.get_doc("Bank Transaction", bank_transaction)
-    )
+    je_name = _resolve_name(journal_entry)
+    bt_name = _resolve_name(bank_transaction)
+
+    # Only the docstatus of the Journal Entry is needed; a document passed in is used as is
+    if isinstance(journal_entry, str):
+        je_docstatus = frappe.db.get_value("Journal Entry", je_name, "docstatus")
+    else:
+        je_docstatus = journal_entry.docstatus
 
     # Preconditions
-    if je.docstatus != 1:
+    if je_docstatus != 1:
         return
-    if bt.docstatus != 1:
+
+    # Prevent duplicate reconciliation (indexed lookup, before loading any document)
+    if _is_reconciled_with("Journal Entry", je_name, bt_name):
         return
 
-    # Prevent duplicate reconciliation by checking existing child rows
-    for row in bt.get("journal_entries") or []:
-        if row.get("journal_entry") == je.name:
-            return
+    # Always reload the Bank Transaction: the caller may be its own on_submit hook
+    bt = frappe.get_doc("Bank Transaction", bt_name)
+    if bt.docstatus != 1:
+        return
 
-    allocated_amount = flt(bt.deposit or bt.withdrawal)
+    # Callers that created the voucher already know the amount
+    if allocated_amount is None:
+        allocated_amount = flt(bt.deposit or bt.withdrawal)
 
     # Append reconciliation row (standard ERPNext v15 fieldnames)
     bt.append(
         "payment_entries",
         {
             "payment_document": "Journal Entry",
-            "payment_entry": je.name,
+            "payment_entry": je_name,
             "allocated_amount": allocated_amount,
         },
     )
@@ -391,10 +631,4 @@ def reconcile_je_and_bt(journal_entry, bank_transaction):
 
     bt.save(ignore_permissions=True)
 
-    frappe.publish_realtime(
-        event="bank_transaction_reload",
-        message={
-            "doctype": bt.doctype,
-            "name": bt.name,
-        }
-    )
\ No newline at end of file
+    notify_bank_transaction_reload(bt)
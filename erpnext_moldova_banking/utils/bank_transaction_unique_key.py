@@ -6,10 +6,55 @@ def make_transaction_unique_key(company, bank_account, posting_date, deposit, wi
     """Build a deterministic unique key for a bank transaction."""
     # Signed amount: incoming positive, outgoing negative
     amount = (deposit or 0) - (withdrawal or 0)
-    posting_date_str = posting_date.isoformat() if posting_date else ""
     ref = (reference_number or "").strip()
 
-    return f"{company}::{bank_account}::{posting_date_str}::{amount:.2f}::{ref}"
+    return f"{_unique_key_prefix(company, bank_account, posting_date)}{amount:.2f}::{ref}"
+
+
+def _unique_key_prefix(company, bank_account, posting_date):
+    posting_date_str = posting_date.isoformat() if posting_date else ""
+    return f"{company}::{bank_account}::{posting_date_str}::"
+
+
+def _is_duplicate_in_import(company, bank_account, posting_date, unique_key):
+    """Check a unique key against existing Bank Transactions during Data Import.
+
+    Instead of one query per imported row, existing keys are loaded once per
+    (company, bank_account, date) and kept for the rest of the import job.
+    Accepted keys are added to the same set, so repeated lines within the
+    imported file are caught as well, but only once the row is committed:
+    a row rejected after this hook is rolled back and its key is not kept.
+
+    Every key in a scope starts with the same company/bank account/date
+    prefix, so only the remaining amount/reference part is kept in the set.
+    Keys are lowercased, matching the case-insensitive collation that
+    `frappe.db.exists` compares under outside imports.
+    """
+    index = getattr(frappe.local, "bank_transaction_unique_keys", None)
+    if index is None:
+        index = frappe.local.bank_transaction_unique_keys = {}
+
+    scope = (company, bank_account, posting_date)
+    prefix = _unique_key_prefix(company, bank_account, posting_date).lower()
+
+    keys = index.get(scope)
+    if keys is None:
+        keys = index[scope] = {
+            (key or "").lower().removeprefix(prefix)
+            for key in frappe.get_all(
+                "Bank Transaction",
+                filters={"company": company, "bank_account": bank_account, "date": posting_date},
+                pluck="unique_key",
+            )
+        }
+
+    key = unique_key.lower().removeprefix(prefix)
+    if key in keys:
+        return True
+
+    # Data Import commits every row on its own and rollback drops pending callbacks
+    frappe.db.after_commit.add(lambda: keys.add(key))
+    return False
 
 
 def ensure_unique_transaction(doc, method=None):
@@ -22,7 +67,8 @@ def ensure_unique_transaction(doc, method=None):
 
     # Make sure company is set (can be derived from Bank Account)
     if not getattr(doc, "company", None) and getattr(doc, "bank_account", None):
-        doc.company = frappe.db.get_value("Bank Account", doc.bank_account, "company")
+        # Cached: every row of an import shares the same Bank Account
+        doc.company = frappe.get_cached_value("Bank Account", doc.bank_account, "company")
 
     # Adjust this field name if your DocType uses another name for date
     posting_date = getattr(doc, "date", None) or getattr(doc, "posting_date", None)
@@ -40,7 +86,12 @@ def ensure_unique_transaction(doc, method=None):
     doc.unique_key = unique_key
 
     # Check for duplicate before inserting
-    if frappe.db.exists("Bank Transaction", {"unique_key": unique_key}):
+    if frappe.flags.in_import:
+        is_duplicate = _is_duplicate_in_import(doc.company, doc.bank_account, posting_date, unique_key)
+    else:
+        is_duplicate = frappe.db.exists("Bank Transaction", {"unique_key": unique_key})
+
+    if is_duplicate:
         amount = (getattr(doc, "deposit", 0) or 0) - (getattr(doc, "withdrawal", 0) or 0)
         ref = (getattr(doc, "reference_number", "") or "").strip() or "-"
 
@@ -1,10 +1,5 @@
 from __future__ import annotations
 
-import json
-import secrets
-from typing import Any, Dict
-from urllib.parse import urlparse
-
 import frappe
 
 SETTINGS_DOCTYPE = "Moldova Banking Settings"
@@ -18,6 +13,8 @@ DEFAULT_KEY_LENGTH = 48
 
 def _generate_key(length: int = DEFAULT_KEY_LENGTH) -> str:
     """Generate a URL-safe random key."""
+    import secrets
+
     token = secrets.token_urlsafe(max(32, length))
     return token[:length]
 
@@ -33,6 +30,8 @@ def _normalize_path(endpoint: str) -> str:
         return ""
 
     if "://" in endpoint:
+        from urllib.parse import urlparse
+
         parsed = urlparse(endpoint)
         return (parsed.path or "").strip()
 
@@ -10,7 +10,7 @@ def get_idno_fields():
         "supplier": "idno"
     }
     """
-    settings = frappe.get_single("Moldova Banking Settings")
+    settings = frappe.get_cached_doc("Moldova Banking Settings")
 
     return {
         "company": settings.company_idno_field or "tax_id",